@@ -1,41 +1,121 @@
-import sounddevice as sd
-import numpy as np
+from loguru import logger
+import aiohttp
+import asyncio
+import orjson
+import sys
+
 import requests
-from scipy.io.wavfile import write
-import io
+import sounddevice as sd
+import webrtcvad
 
 API_URL = "http://localhost:8756/transcribe"
+STREAM_URL = "ws://localhost:8756/stream"
 API_KEY = "your_api_key_here"  # Ensure this matches your actual API key
 
-def record_audio(duration=5, fs=44100, channels=1):
-    print("Recording...")
-    recording = sd.rec(int(duration * fs), samplerate=fs, channels=channels, dtype='int16')
-    sd.wait()
-    print("Recording stopped.")
-    return recording, fs
-
-def audio_to_bytesio(audio, fs):
-    bytes_io = io.BytesIO()
-    write(bytes_io, fs, audio)
-    bytes_io.seek(0)  # Go to the beginning of the BytesIO buffer
-    return bytes_io
-
-def send_audio_to_server(audio_data):
-    files = {'file': ('audio.wav', audio_data, 'audio/wav')}
-    headers = {'Authorization': API_KEY}
-    response = requests.post(API_URL, files=files, headers=headers)
+SAMPLE_RATE = 16000
+FRAME_SAMPLES = 320  # 20 ms at 16 kHz, one webrtcvad frame
+
+# Returns an input stream that puts speech frames onto frame_queue, followed by None once the VAD sees the utterance end
+def record_audio(frame_queue, loop, fs=SAMPLE_RATE, channels=1, aggressiveness=2, trailing_silence_ms=300):
+    # Capture at Whisper's native rate so neither side resamples, fail early if the default device can't do mono 16 kHz
+    sd.check_input_settings(samplerate=fs, channels=channels, dtype='int16')
+    vad = webrtcvad.Vad(aggressiveness)
+    silence_limit = trailing_silence_ms * fs // (1000 * FRAME_SAMPLES)
+    speaking = False
+    silent_frames = 0
+
+    def callback(indata, frame_count, time_info, status):
+        nonlocal speaking, silent_frames
+        # indata is reused by sounddevice after we return, copy it out once as the bytes the VAD and the server both take
+        frame = bytes(indata)
+        if vad.is_speech(frame, fs):
+            if not speaking:
+                logger.debug("Recording...")
+            speaking = True
+            silent_frames = 0
+            loop.call_soon_threadsafe(frame_queue.put_nowait, frame)
+        elif speaking:
+            loop.call_soon_threadsafe(frame_queue.put_nowait, frame)
+            silent_frames += 1
+            if silent_frames >= silence_limit:
+                logger.debug("Recording stopped.")
+                speaking = False
+                silent_frames = 0
+                loop.call_soon_threadsafe(frame_queue.put_nowait, None)
+
+    return sd.InputStream(samplerate=fs, channels=channels, dtype='int16', blocksize=FRAME_SAMPLES, callback=callback)
+
+def send_audio_to_server(pcm, fs=SAMPLE_RATE):
+    # Raw PCM, no WAV container or multipart framing
+    headers = {'Content-Type': f'audio/s16le;rate={fs};channels=1', 'Authorization': API_KEY}
+    response = requests.post(API_URL, data=pcm, headers=headers)
     return response.json()
 
-def continuously_transcribe():
-    try:
+async def continuously_transcribe():
+    loop = asyncio.get_running_loop()
+    frame_queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+    with record_audio(frame_queue, loop):
+        logger.info("Listening...")
+        frames = []
         while True:
-            audio, fs = record_audio(duration=5)  # Record for 5 seconds
-            audio_data = audio_to_bytesio(audio, fs)
-            print("Sending audio for transcription...")
-            result = send_audio_to_server(audio_data)
+            frame = await frame_queue.get()
+            if frame is not None:
+                frames.append(frame)
+                continue
+            audio = b"".join(frames)
+            frames.clear()
+            logger.debug("Sending audio for transcription...")
+            result = await loop.run_in_executor(None, send_audio_to_server, audio)
             print("Transcription:", result.get('transcription', 'No transcription received.'))
-    except KeyboardInterrupt:
-        print("Exiting...")
+
+async def audio_producer(ws, frame_queue):
+    while True:
+        frame = await frame_queue.get()
+        if frame is None:
+            await ws.send_str("end")
+        else:
+            await ws.send_bytes(frame)
+
+async def send_keepalives(ws, interval=5):
+    while not ws.closed:
+        await ws.send_str("keepalive")
+        await asyncio.sleep(interval)
+
+async def stream_transcribe():
+    loop = asyncio.get_running_loop()
+    frame_queue: asyncio.Queue[bytes | None] = asyncio.Queue()
+    headers = {'Authorization': API_KEY}
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(STREAM_URL, headers=headers) as ws:
+            with record_audio(frame_queue, loop):
+                logger.info("Listening...")
+                producer_task = asyncio.create_task(audio_producer(ws, frame_queue))
+                keepalive_task = asyncio.create_task(send_keepalives(ws))
+                try:
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.BINARY:
+                            # The server sends orjson bytes
+                            result = orjson.loads(msg.data)
+                            if "error" in result:
+                                print("Server dropped the utterance:", result['error'])
+                                continue
+                            print("Transcription:", result.get('transcription', 'No transcription received.'))
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+                finally:
+                    producer_task.cancel()
+                    keepalive_task.cancel()
 
 if __name__ == "__main__":
-    continuously_transcribe()
+    # "post" sends one request per utterance, the default streams frames over a single websocket
+    mode = sys.argv[1] if len(sys.argv) > 1 else "stream"
+    # Hide the per-utterance debug chatter unless someone lowers this
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    try:
+        if mode == "post":
+            asyncio.run(continuously_transcribe())
+        else:
+            asyncio.run(stream_transcribe())
+    except KeyboardInterrupt:
+        logger.info("Exiting...")
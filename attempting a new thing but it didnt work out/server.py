@@ -1,29 +1,49 @@
+import asyncio
+import io
+import os
 import sys
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
-from fastapi.responses import JSONResponse
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException, Request, WebSocket
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 import whisperx
 import torch
 import numpy as np
+import orjson
+import soundfile as sf
+
+# audio_backend lives one directory up, shared with the hotkey scripts and transcriber_server
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from audio_backend import SAMPLE_RATE, BodyTooLarge, TranscribeBatcher, cuda_compute_type, parse_audio_content_type, pcm_to_float32, read_body, transcribe_clips
 
 app = FastAPI()
+# Transcripts of long audio run to tens of KB of JSON, small bodies aren't worth compressing
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # API Key Setup
 API_KEY = "boy_i_sure_hope_you_supplied_one_from_the_command_line_cause_this_string_is_going_in_the_repo"
 
+# Number of batches allowed on the GPU at once, each one gets its own CTranslate2 worker
+TRANSCRIBE_WORKERS = 2
+
 print("loading model, yeehaw")
 # Load model and transcribe audio
 if torch.cuda.is_available():
     # https://huggingface.co/openai/whisper-large-v2
     model = "large-v2"
-    audio_model = whisperx.load_model(model, device="cuda", language="en")
+    compute_type = cuda_compute_type()
+    # load_model doesn't expose num_workers, so build the CTranslate2 model ourselves and hand it over.
+    # With one worker concurrent generate calls queue behind each other, with more their kernel launches overlap.
+    whisper_model = whisperx.asr.WhisperModel(model, device="cuda", compute_type=compute_type, num_workers=TRANSCRIBE_WORKERS, cpu_threads=4)
+    audio_model = whisperx.load_model(model, device="cuda", language="en", compute_type=compute_type, asr_options={"beam_size": 1, "best_of": 1}, model=whisper_model)
 else:
     print("YOU GOT NO GPU ACTIVE YO")
     # https://huggingface.co/openai/whisper-small.en
     model = "small.en"
-    audio_model = whisperx.load_model(model, device="cpu", language="en", compute_type="float32")
+    audio_model = whisperx.load_model(model, device="cpu", language="en", compute_type="int8")
 print("🚀")
 
-def get_api_key(request: Request):
+def get_api_key(request: Request | WebSocket):
     # we in dev baybee
     return API_KEY
     # try:
@@ -39,29 +59,95 @@ async def api_key_check(request: Request, call_next):
         return JSONResponse(status_code=401, detail="Invalid API Key")
     return await call_next(request)
 
+# Requests that arrive within MAX_WAIT_MS of each other are transcribed in one call
+MAX_BATCH = 8
+MAX_WAIT_MS = 20
+
+def transcribe_batch(clips: list[np.ndarray]) -> list[dict]:
+    # Both endpoints hand over int16, converted straight into the buffer whisperx gets
+    return transcribe_clips(audio_model, clips, convert=pcm_to_float32)
+
+batcher = TranscribeBatcher(transcribe_batch, ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS), TRANSCRIBE_WORKERS, MAX_BATCH, MAX_WAIT_MS / 1000, log=print)
+
+@app.on_event("startup")
+async def start_batcher():
+    app.state.batcher = asyncio.create_task(batcher.run())
+
 # Health Check Endpoint
 @app.get("/")
 async def read_root():
     return {"message": "Hello from the transcription API"}
 
 # Transcribe Endpoint
+# Accepts either a multipart WAV upload or a raw audio/s16le;rate=16000;channels=1 body
 @app.post("/transcribe")
-async def transcribe_audio(file: UploadFile = File(...)):
-    if not file.filename.endswith('.wav'):
-        raise HTTPException(status_code=400, detail="File format not supported. Please upload a WAV file.")
-    
+async def transcribe_audio(request: Request):
+    content_type = request.headers.get("Content-Type", "")
+    if content_type.startswith("audio/"):
+        try:
+            sample_rate, channel_count = parse_audio_content_type(content_type, "audio/s16le")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if sample_rate != SAMPLE_RATE or channel_count != 1:
+            raise HTTPException(status_code=400, detail="Raw PCM must be 16 kHz mono (audio/s16le;rate=16000;channels=1).")
+        try:
+            # Little-endian like the client's capture, so the samples are read in place as native int16
+            audio_array = np.frombuffer(await read_body(request), np.int16)
+        except BodyTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    else:
+        file = (await request.form()).get("file")
+        if file is None or not file.filename.endswith('.wav'):
+            raise HTTPException(status_code=400, detail="File format not supported. Please upload a WAV file.")
+        try:
+            # Parse the RIFF container in C instead of reading its header as samples
+            audio_array, sample_rate = sf.read(io.BytesIO(await file.read()), dtype="int16")
+        except sf.LibsndfileError as e:
+            raise HTTPException(status_code=400, detail=f"Could not read WAV file: {e}")
+        if sample_rate != SAMPLE_RATE or audio_array.ndim != 1:
+            raise HTTPException(status_code=400, detail="WAV file must be 16 kHz mono.")
+
     try:
-        # Read audio file into memory
-        audio_content = await file.read()
-        audio_array = np.frombuffer(audio_content, np.int16).flatten().astype(np.float32) / 32768.0
-        
-        # Transcribe the audio
-        result = audio_model.transcribe(audio_array, batch_size=16)
+        # Both branches hand over int16, the batcher converts it to float32 directly into the buffer it gives whisperx
+        result = await batcher.submit(audio_array)
         
-        return {"transcription": result}
+        # A plain dict would go through jsonable_encoder and json.dumps, orjson serializes it in one pass
+        return ORJSONResponse({"transcription": result})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Streaming Endpoint
+# Binary messages are 16 kHz int16 PCM frames, "end" marks the end of an utterance
+@app.websocket("/stream")
+async def stream_audio(websocket: WebSocket):
+    if get_api_key(websocket) != API_KEY:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+
+    pcm = bytearray()
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            break
+        if message.get("bytes") is not None:
+            pcm += message["bytes"]
+        elif message.get("text") == "end":
+            if len(pcm) % 2:
+                # Half a sample means a frame got cut, drop the utterance and tell the client rather than the connection
+                await websocket.send_bytes(orjson.dumps({"error": f"Utterance of {len(pcm)} bytes is not whole int16 samples"}))
+                pcm = bytearray()
+                continue
+            # Hand the accumulated buffer over as is and start a fresh one, rather than copying it out and clearing it
+            audio_array = np.frombuffer(pcm, np.int16)
+            pcm = bytearray()
+            result = await batcher.submit(audio_array)
+            # send_json goes through json.dumps to str and then encodes it, orjson writes the bytes directly
+            await websocket.send_bytes(orjson.dumps({"transcription": result}, option=orjson.OPT_SERIALIZE_NUMPY))
+        # anything else is a keepalive
+
 if __name__ == "__main__":
     import uvicorn
     if len(sys.argv) > 1:
@@ -0,0 +1,419 @@
+import asyncio
+import bisect
+import faster_whisper
+import functools
+import os
+import time
+import torch
+import numpy as np
+import whisperx
+from concurrent.futures import Executor
+from loguru import logger
+from typing import *
+
+# Shared by the hotkey entry points and the servers so capture, decoding and model settings only live in one place
+
+SAMPLE_RATE = 16000
+PCM_SCALE = np.float32(1 / 32768.0)
+
+try:
+    import numba
+
+    from numba import types
+
+    def _arrays(dtype, *layouts) -> list:
+        # Audio wrapped with np.frombuffer(bytes) is read-only, and numba types those arrays separately
+        return [types.Array(dtype, 1, layout, readonly=readonly) for layout in layouts for readonly in (False, True)]
+
+    # Compiled for these signatures at import rather than on the first utterance, and cached on disk between runs.
+    # The cast and the scale happen in the same vectorized loop, numpy's ufunc casts through a scratch buffer first.
+    @numba.njit(
+        [types.void(pcm, out) for pcm in _arrays(types.int16, "C", "A") for out in (types.float32[::1], types.float32[:])],
+        cache=True,
+    )
+    def _scale_pcm(pcm, out):
+        for i in range(pcm.shape[0]):
+            out[i] = pcm[i] * PCM_SCALE
+
+    # Gathers one channel of interleaved audio into a contiguous array in a single read, split across cores
+    @numba.njit(
+        [types.float32[::1](interleaved, types.int64, types.int64) for interleaved in _arrays(types.float32, "C")],
+        parallel=True,
+        cache=True,
+    )
+    def extract_channel(interleaved, channel_count, channel):
+        out = np.empty(interleaved.shape[0] // channel_count, np.float32)
+        for i in numba.prange(out.shape[0]):
+            out[i] = interleaved[i * channel_count + channel]
+        return out
+except ImportError:
+    def _scale_pcm(pcm: np.ndarray, out: np.ndarray):
+        np.multiply(pcm, PCM_SCALE, out=out)
+
+    def extract_channel(interleaved: np.ndarray, channel_count: int, channel: int) -> np.ndarray:
+        return np.ascontiguousarray(interleaved[channel::channel_count])
+
+def pcm_to_float32(pcm: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # One pass over the int16 samples, written straight into out when the caller already has somewhere to put them
+    if out is None:
+        out = np.empty(pcm.shape, np.float32)
+    _scale_pcm(pcm, out)
+    return out
+
+def host_audio_buffer(samples: int, zeroed: bool = False) -> np.ndarray:
+    # float32 audio bound for whisperx. With a GPU it is page-locked, so each VAD chunk sliced out of it uploads as an
+    # async DMA instead of going through the shared staging buffer in move_feature_extraction_to_gpu, which has to wait
+    # for the previous upload first. torch's caching host allocator recycles these blocks.
+    if not torch.cuda.is_available():
+        return np.zeros(samples, np.float32) if zeroed else np.empty(samples, np.float32)
+    if zeroed:
+        return torch.zeros(samples, dtype=torch.float32, pin_memory=True).numpy()
+    return torch.empty(samples, dtype=torch.float32, pin_memory=True).numpy()
+
+AUDIO_QUEUE_SIZE = 4
+# Transcripts are never dropped, a full result queue makes the transcriber wait, which then drops stale audio instead
+RESULT_QUEUE_SIZE = 8
+dropped_audio_count = 0
+
+def put_dropping_oldest(audio_queue: asyncio.Queue, item: Any, log: Callable[[str], None] = logger.warning):
+    # When the transcriber can't keep up, stale audio is worth less than the latest utterance
+    global dropped_audio_count
+    try:
+        audio_queue.put_nowait(item)
+    except asyncio.QueueFull:
+        audio_queue.get_nowait()
+        audio_queue.put_nowait(item)
+        dropped_audio_count += 1
+        log(f"Transcriber lagging, dropped stale audio ({dropped_audio_count} so far)")
+
+# VAD chunks per whisperx forward pass, int8 weights leave enough VRAM for 32
+TRANSCRIBE_BATCH_SIZE = 32
+
+# Clips sharing a batch are separated by this much silence so whisperx's VAD never merges two of them into one chunk
+BATCH_SEPARATOR_SECONDS = 30
+
+# A lone push-to-talk clip waits out the whole window, so keep it short. The servers' TranscribeBatcher collects with it too.
+async def collect_batch(audio_queue: asyncio.Queue, max_batch: int = 8, max_wait: float = 0.02) -> list[Any]:
+    batch = [await audio_queue.get()]
+    # Take whatever already queued up behind the GPU without waiting on it
+    while len(batch) < max_batch and not audio_queue.empty():
+        batch.append(audio_queue.get_nowait())
+    deadline = time.monotonic() + max_wait
+    while len(batch) < max_batch:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(audio_queue.get(), remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+def _copy_clip(clip: np.ndarray, out: np.ndarray):
+    out[:] = clip
+
+@torch.inference_mode()
+def transcribe_clips(
+    audio_model: Any,
+    clips: list[np.ndarray],
+    convert: Optional[Callable[[np.ndarray, np.ndarray], Any]] = None,
+    language: Optional[str] = None
+) -> list[dict]:
+    # convert(clip, out) writes a clip into its float32 slot, e.g. pcm_to_float32 for int16 audio.
+    # Without it the clips are already float32 and a lone one is transcribed as is.
+    # language overrides the model's, whisperx only detects one per call so mixed batches need it set.
+    if len(clips) == 1 and convert is None:
+        return [audio_model.transcribe(clips[0], batch_size=TRANSCRIBE_BATCH_SIZE, language=language)]
+    convert = convert or _copy_clip
+
+    # Submit every clip in one call so whisperx fills its batch, then split the segments back out by start time.
+    # Clips go into their slot of one pinned buffer with silence only between them, not after the last.
+    gap = SAMPLE_RATE * BATCH_SEPARATOR_SECONDS
+    audio = host_audio_buffer(sum(len(clip) for clip in clips) + gap * (len(clips) - 1), zeroed=True)
+    offsets = []
+    position = 0
+    for clip in clips:
+        offsets.append(position / SAMPLE_RATE)
+        convert(clip, audio[position:position + len(clip)])
+        position += len(clip) + gap
+    result = audio_model.transcribe(audio, batch_size=TRANSCRIBE_BATCH_SIZE, language=language)
+    if len(clips) == 1:
+        return [result]
+
+    # Hand each segment back to the clip it started in, with times relative to that clip.
+    # The VAD can start a segment slightly before a clip's offset, so look up half a gap later.
+    results = [{"segments": [], "language": result.get("language")} for _ in clips]
+    for segment in result["segments"]:
+        i = bisect.bisect_right(offsets, segment["start"] + BATCH_SEPARATOR_SECONDS / 2) - 1
+        offset = offsets[i]
+        results[i]["segments"].append({**segment, "start": segment["start"] - offset, "end": segment["end"] - offset})
+    return results
+
+# transcribe also runs whisperx's pyannote VAD, which is plain PyTorch and benefits from float16 autocast
+@torch.autocast("cuda", dtype=torch.float16, enabled=torch.cuda.is_available())
+def transcribe_clips_autocast(
+    audio_model: Any,
+    clips: list[np.ndarray],
+    convert: Optional[Callable[[np.ndarray, np.ndarray], Any]] = None,
+    language: Optional[str] = None
+) -> list[dict]:
+    return transcribe_clips(audio_model, clips, convert=convert, language=language)
+
+class TranscribeBatcher:
+    # Requests that arrive within max_wait of each other are transcribed in one call, on up to workers threads of
+    # executor at once. Shared by the servers, transcribe_batch(clips) returns one result per clip.
+    def __init__(
+        self,
+        transcribe_batch: Callable[[list[np.ndarray]], list[dict]],
+        executor: Executor,
+        workers: int,
+        max_batch: int = 8,
+        max_wait: float = 0.02,
+        log: Callable[[str], None] = logger.error
+    ):
+        self.transcribe_batch = transcribe_batch
+        self.executor = executor
+        self.workers = workers
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.log = log
+        # audio and the future its transcription is delivered to
+        self.queue: asyncio.Queue[tuple[np.ndarray, asyncio.Future]] = asyncio.Queue()
+
+    async def submit(self, audio: np.ndarray) -> dict:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((audio, future))
+        return await future
+
+    async def _dispatch(self, items: list[tuple[np.ndarray, asyncio.Future]], slots: asyncio.Semaphore):
+        loop = asyncio.get_running_loop()
+        try:
+            # transcribe blocks for seconds, run it on a worker thread so the event loop keeps accepting requests
+            results = await loop.run_in_executor(self.executor, self.transcribe_batch, [audio for audio, _ in items])
+        except Exception as e:
+            self.log(f"Batched transcription of {len(items)} requests failed: {e}")
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), result in zip(items, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            slots.release()
+
+    async def run(self):
+        slots = asyncio.Semaphore(self.workers)
+        in_flight = set()
+        while True:
+            # Wait for a free worker before collecting, requests keep piling into the next batch meanwhile
+            await slots.acquire()
+            items = await collect_batch(self.queue, self.max_batch, self.max_wait)
+            task = asyncio.create_task(self._dispatch(items, slots))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+
+# Raw audio bodies past this are refused before anything is allocated, 10 minutes of 48 kHz stereo float32
+MAX_BODY_BYTES = 10 * 60 * 48000 * 2 * 4
+
+class BodyTooLarge(ValueError):
+    pass
+
+async def read_body(request: "Request", max_bytes: int = MAX_BODY_BYTES) -> bytearray:
+    # Stream the body into one buffer sized from Content-Length, rather than collecting chunks and joining them
+    content_length = request.headers.get("content-length")
+    if content_length is None:
+        # Nothing to size it from, grow it but give up as soon as it passes the limit
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise BodyTooLarge(f"Body is longer than the {max_bytes} byte limit")
+        return buffer
+    length = int(content_length)
+    if length > max_bytes:
+        raise BodyTooLarge(f"Content-Length of {length} bytes is over the {max_bytes} byte limit")
+    buffer = bytearray(length)
+    offset = 0
+    async for chunk in request.stream():
+        end = offset + len(chunk)
+        if end > len(buffer):
+            raise ValueError(f"Body is longer than its Content-Length of {len(buffer)} bytes")
+        buffer[offset:end] = chunk
+        offset = end
+    if offset != len(buffer):
+        raise ValueError(f"Body ended after {offset} of {len(buffer)} bytes")
+    return buffer
+
+def parse_audio_content_type(content_type: str, media_type: str) -> tuple[int, int]:
+    # Raw audio with optional rate and channels parameters, e.g. audio/f32le;rate=48000;channels=2
+    given, *params = [part.strip() for part in content_type.split(";")]
+    if given != media_type:
+        raise ValueError(f"Invalid Content-Type {content_type!r}. Expected {media_type!r}.")
+    values = dict(param.split("=", 1) for param in params if "=" in param)
+    return int(values.get("rate", SAMPLE_RATE)), int(values.get("channels", 1))
+
+def _log_mel(audio: torch.Tensor, window: torch.Tensor, filters: torch.Tensor) -> torch.Tensor:
+    # whisperx.audio.log_mel_spectrogram builds its hann window on the host and copies it over on every call,
+    # a synchronous copy a CUDA graph can't capture. Same maths with the window and filterbank already on the device.
+    stft = torch.stft(audio, whisperx.audio.N_FFT, whisperx.audio.HOP_LENGTH, window=window, return_complex=True)
+    magnitudes = stft[..., :-1].abs() ** 2
+    log_spec = torch.clamp(filters @ magnitudes, min=1e-10).log10()
+    log_spec = torch.maximum(log_spec, log_spec.max() - 8.0)
+    return (log_spec + 4.0) / 4.0
+
+def _capture_log_mel_graph(window: torch.Tensor, filters: torch.Tensor) -> tuple[torch.Tensor, torch.Tensor, torch.cuda.CUDAGraph]:
+    # Every VAD chunk is zero padded to 30 s, so the log-mel always sees the same shape and
+    # can be recorded once as a CUDA graph, each chunk is then one replay instead of a launch per kernel.
+    # float16 would underflow the log-mel clamp, so keep features in float32 even under autocast
+    static_audio = torch.zeros(whisperx.audio.N_SAMPLES, dtype=torch.float32, device="cuda")
+    with torch.autocast("cuda", enabled=False):
+        # Warm up on a side stream first, this plans the FFT outside the capture
+        side = torch.cuda.Stream()
+        side.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(side):
+            for _ in range(2):
+                _log_mel(static_audio, window, filters)
+        torch.cuda.current_stream().wait_stream(side)
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_features = _log_mel(static_audio, window, filters)
+    return static_audio, static_features, graph
+
+def move_feature_extraction_to_gpu(audio_model: Any):
+    # whisperx builds log-mel features on the CPU, instead upload each VAD chunk through one pinned buffer and
+    # build them on the GPU. The features come back to the host afterwards: the pipeline runs on the CPU device and
+    # faster-whisper's encode wraps them with np.ascontiguousarray, which can't take a CUDA tensor.
+    n_mels = audio_model.model.feat_kwargs.get("feature_size") or 80
+    pinned = torch.empty(whisperx.audio.N_SAMPLES, dtype=torch.float32, pin_memory=True)
+    uploaded = torch.cuda.Event()
+    uploaded.record()
+    window = torch.hann_window(whisperx.audio.N_FFT, device="cuda")
+    filters = whisperx.audio.mel_filters("cuda", n_mels)
+    static_audio, static_features, graph = _capture_log_mel_graph(window, filters)
+
+    def preprocess(inputs):
+        audio = torch.from_numpy(inputs["inputs"])
+        n = audio.shape[0]
+        if n > whisperx.audio.N_SAMPLES:
+            # Longer than the captured shape, build these eagerly
+            with torch.autocast("cuda", enabled=False):
+                features = _log_mel(audio.to("cuda"), window, filters)
+            return {"inputs": features.cpu()}
+        if audio.is_pinned():
+            # a slice of a pinned array the caller decoded into
+            static_audio[:n].copy_(audio, non_blocking=True)
+        else:
+            # the previous upload may still be reading the buffer
+            uploaded.synchronize()
+            pinned[:n].copy_(audio)
+            static_audio[:n].copy_(pinned[:n], non_blocking=True)
+            uploaded.record()
+        static_audio[n:].zero_()
+        graph.replay()
+        # A fresh host copy, the next replay overwrites static_features
+        return {"inputs": static_features.cpu()}
+
+    audio_model.preprocess = preprocess
+
+def move_vad_to_gpu(audio_model: Any, log: Callable[[str], None] = logger.info):
+    # The pyannote VAD runs on every transcribe call, on the CPU it costs more than the decoding.
+    # whisperx loads it on load_model's device, but make sure rather than find out from the latency.
+    pipeline = getattr(audio_model.vad_model, "vad_pipeline", audio_model.vad_model)
+    segmentation = getattr(pipeline, "_segmentation", None)
+    if segmentation is None:
+        # Not the pyannote VAD, nothing to move
+        return
+    if segmentation.model.device.type != "cuda":
+        segmentation.to(torch.device("cuda"))
+    # Opt-in, torch.compile needs Triton, which isn't packaged for Windows. Sliding window batches share one shape
+    # apart from the last, so reduce-overhead records about two CUDA graphs and replays them from then on.
+    if os.getenv("WHISPERX_COMPILE_VAD"):
+        segmentation.model = torch.compile(segmentation.model, mode="reduce-overhead")
+        log("Compiled whisperx VAD")
+    log(f"whisperx VAD is on {segmentation.model.device}")
+
+@torch.inference_mode()
+def warm_up(audio_model: Any):
+    # The first calls pay for kernel selection and allocator growth, get that out of the way before the first request.
+    # Silence never makes it past whisperx's VAD, so also push it straight through the ASR pipeline.
+    # Without a preset language transcribe leaves the tokenizer unset, borrow an English one for the direct passes
+    detect_language = audio_model.tokenizer is None
+    for seconds in (1.0, 5.0, 30.0):
+        silence = np.zeros(int(SAMPLE_RATE * seconds), np.float32)
+        audio_model.transcribe(silence, batch_size=TRANSCRIBE_BATCH_SIZE)
+        if detect_language:
+            audio_model.tokenizer = faster_whisper.tokenizer.Tokenizer(audio_model.model.hf_tokenizer, audio_model.model.model.is_multilingual, task="transcribe", language="en")
+        try:
+            list(audio_model([{"inputs": silence}], batch_size=1))
+        finally:
+            if detect_language:
+                audio_model.tokenizer = None
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+# Set for every entry point, they all load their model through here.
+# Audio shapes repeat, let cuDNN pick the fastest algorithms for them once
+torch.backends.cudnn.benchmark = True
+# TF32 tensor cores for the float32 matmuls in the VAD and feature extraction
+torch.set_float32_matmul_precision("high")
+
+def cuda_compute_type() -> str:
+    # WHISPERX_COMPUTE_TYPE overrides the guess, e.g. float16 on cards where int8 is slower
+    override = os.getenv("WHISPERX_COMPUTE_TYPE")
+    if override:
+        return override
+    # int8 weights with float16 activations need tensor cores (compute capability 7.0+)
+    if torch.cuda.get_device_capability()[0] >= 7:
+        return "int8_float16"
+    return "int8"
+
+@functools.lru_cache(maxsize=None)
+def load_audio_model(language: Optional[str] = "en") -> Any:
+    # Cached so every caller in the process shares one copy of the weights rather than loading large-v2 again.
+    # language=None lets whisperx detect it per call.
+    if torch.cuda.is_available():
+        # https://huggingface.co/openai/whisper-large-v2
+        logger.info("Loading whisperx large-v2")
+        # Greedy decoding is plenty for dictation. Pass vad_options={"vad_onset": ..., "vad_offset": ...}
+        # here to make the VAD cut tighter around speech if segments carry too much leading silence.
+        audio_model = whisperx.load_model("large-v2", device="cuda", language=language, compute_type=cuda_compute_type(), asr_options={"beam_size": 1, "best_of": 1})
+        move_feature_extraction_to_gpu(audio_model)
+        move_vad_to_gpu(audio_model)
+    else:
+        # https://huggingface.co/openai/whisper-small.en
+        logger.warning("No GPU, loading whisperx small.en on the CPU")
+        audio_model = whisperx.load_model("small.en", device="cpu", language=language, compute_type="int8")
+    logger.info("Warming up whisperx model")
+    warm_up(audio_model)
+    return audio_model
+
+# Picks the input device index to open from sounddevice's device list, None means the system default
+MicFilter = Callable[["sd.DeviceList"], Optional[int]]
+
+def default_microphone(devices: "sd.DeviceList") -> Optional[int]:
+    return None
+
+def named_microphone(name: str) -> MicFilter:
+    last_index: Optional[int] = None
+
+    def matches(device) -> bool:
+        return device["name"] == name and device["max_input_channels"] > 0
+
+    def find(devices: "sd.DeviceList") -> Optional[int]:
+        # The index rarely moves between reconnects, check where it was last time before scanning
+        nonlocal last_index
+        if last_index is not None and last_index < len(devices) and matches(devices[last_index]):
+            return last_index
+        last_index = next((i for i,d in enumerate(devices) if matches(d)), None)
+        return last_index
+    return find
+
+def query_input_devices() -> "sd.DeviceList":
+    # Imported here so the servers can use this module on machines without PortAudio
+    import sounddevice as sd
+    # PortAudio only enumerates devices when it is initialized, so restart it to see newly plugged in microphones.
+    # Only safe while no stream is open.
+    sd._terminate()
+    sd._initialize()
+    return sd.query_devices()
@@ -1,64 +1,83 @@
 import aiohttp
 import asyncio
+import ssl
 import sys
-
-from concurrent.futures import ThreadPoolExecutor
+import threading
 
 API_KEY: str = None
 PORT: int = None
 SERVER_URL = 'https://localhost'
 
-async def read_input(executor):
+async def open_stdin_reader() -> asyncio.StreamReader:
     loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    try:
+        await loop.connect_read_pipe(lambda: asyncio.StreamReaderProtocol(reader), sys.stdin)
+    except (NotImplementedError, OSError, ValueError):
+        # Windows consoles aren't pipes, feed the reader from a daemon thread so it can't hold up exit
+        def pump():
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(reader.feed_data, line.encode())
+            loop.call_soon_threadsafe(reader.feed_eof)
+        threading.Thread(target=pump, daemon=True).start()
+    return reader
+
+async def read_input(session: aiohttp.ClientSession):
+    reader = await open_stdin_reader()
     while True:
-        # Run input in a separate thread
-        command = await loop.run_in_executor(executor, input, "Enter command (start, stop, exit): ")
-        command = command.strip().lower()
-        if command == "exit":
+        print("Enter command (start, stop, exit): ", end="", flush=True)
+        line = await reader.readline()
+        command = line.decode().strip().lower()
+        if command == "exit" or not line:
             print("Exiting...")
             break
         elif command in ["start", "stop"]:
-            await send_command(command)
+            await send_command(session, command)
         else:
             print("Unknown command.")
 
-async def send_command(command):
+async def send_command(session: aiohttp.ClientSession, command):
     url = f"{SERVER_URL}:{PORT}/{command}_listening"
     headers = {'Authorization': API_KEY}
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, headers=headers) as response:
-            print(f"Command '{command}': {response.status}")
-            print(await response.text())
+    async with session.post(url, headers=headers) as response:
+        print(f"Command '{command}': {response.status}")
+        print(await response.text())
 
-async def receive_results():
+async def receive_results(session: aiohttp.ClientSession):
     url = f"{SERVER_URL}:{PORT}/results"
     headers = {'Authorization': API_KEY}
-    async with aiohttp.ClientSession() as session:
-        async with session.ws_connect(url, headers=headers) as ws:
-            async for msg in ws:
-                if msg.type == aiohttp.WSMsgType.TEXT:
-                    print("Received:", msg.data)
-                elif msg.type == aiohttp.WSMsgType.CLOSED:
-                    break
-                elif msg.type == aiohttp.WSMsgType.ERROR:
-                    break
+    async with session.ws_connect(url, headers=headers) as ws:
+        async for msg in ws:
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                print("Received:", msg.data)
+            elif msg.type == aiohttp.WSMsgType.BINARY:
+                print("Received:", msg.data.decode())
+            elif msg.type == aiohttp.WSMsgType.CLOSED:
+                break
+            elif msg.type == aiohttp.WSMsgType.ERROR:
+                break
 
 async def main():
-    executor = ThreadPoolExecutor(max_workers=1)
-    # Start the results receiver in the background
-    receiver_task = asyncio.create_task(receive_results())
-    # Start the input reader in the background
-    input_task = asyncio.create_task(read_input(executor))
-
-    # Wait for the input_task to complete, indicating the user has chosen to exit
-    await input_task
-    
-    # Cleanup
-    receiver_task.cancel()
+    # One session for the whole run so commands reuse the same TLS connection
+    ssl_context = ssl.create_default_context()
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=4, ssl=ssl_context))
     try:
-        await receiver_task
-    except asyncio.CancelledError:
-        pass
+        # Start the results receiver in the background
+        receiver_task = asyncio.create_task(receive_results(session))
+        # Start the input reader in the background
+        input_task = asyncio.create_task(read_input(session))
+
+        # Wait for the input_task to complete, indicating the user has chosen to exit
+        await input_task
+        
+        # Cleanup
+        receiver_task.cancel()
+        try:
+            await receiver_task
+        except asyncio.CancelledError:
+            pass
+    finally:
+        await session.close()
 
 if __name__ == "__main__":
     assert len(sys.argv) > 2, "Usage: client.py <port> <api_key>"
@@ -1,12 +1,14 @@
+from audio_backend import AUDIO_QUEUE_SIZE, RESULT_QUEUE_SIZE, collect_batch, load_audio_model, pcm_to_float32, put_dropping_oldest, transcribe_clips_autocast
+from loguru import logger
 import speech_recognition as sr
 import asyncio
-import torch
+import sys
 import numpy as np
 import whisperx
 from typing import *
 
 async def record_audio(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[np.ndarray],
     energy: int,
     pause: float,
     dynamic_energy: bool,
@@ -19,41 +21,57 @@ async def record_audio(
 
     loop = asyncio.get_running_loop()
 
-    print("[MIC] Starting listener")
+    logger.debug("Starting listener")
     with sr.Microphone(sample_rate=16000) as source:
-        print("[MIC] found microphone")
+        logger.debug("Found microphone")
         while not stop_future.done():
             audio = await loop.run_in_executor(None, r.listen, source)
-            np_audio = np.frombuffer(audio.get_raw_data(), np.int16).flatten().astype(np.float32) / 32768.0
-            # torch_audio = torch.from_numpy(np_audio)
+            # Stays int16 until the transcriber needs it, half the memory while queued
+            np_audio = np.frombuffer(audio.get_raw_data(), np.int16)
             # print(f"[MIC] Got audio with shape {np_audio.shape}")
-            await audio_queue.put(np_audio)
-    print("[MIC] Listener finished")
+            put_dropping_oldest(audio_queue, np_audio)
+    logger.debug("Listener finished")
+
+def _transcribe_batch(audio_model: Any, batch: list[np.ndarray]) -> list[dict]:
+    # whisperx detects the language once per transcribe call, from the start of the audio, so clips sharing a call
+    # would all come back in the first clip's language. Detect each clip's and batch per language instead.
+    by_language: dict[str, list[int]] = {}
+    for i, clip in enumerate(batch):
+        # detect_language only looks at the first 30 s, and wants them as float32
+        language = audio_model.detect_language(pcm_to_float32(clip[:whisperx.audio.N_SAMPLES]))
+        by_language.setdefault(language, []).append(i)
+    results: list[dict] = [None] * len(batch)
+    for language, indices in by_language.items():
+        for i, result in zip(indices, transcribe_clips_autocast(audio_model, [batch[i] for i in indices], convert=pcm_to_float32, language=language)):
+            results[i] = result
+    return results
 
 async def transcribe_audio(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[np.ndarray],
     result_queue: asyncio.Queue[str],
     audio_model: Any,
     stop_future: asyncio.Future
 ):
-    print("[MIC] Starting transcriber")
+    logger.debug("Starting transcriber")
+    loop = asyncio.get_running_loop()
     while not stop_future.done():
-        audio_data = await audio_queue.get()
-        result = audio_model.transcribe(audio_data, batch_size=16)
-        # predicted_text = str(result["text"]).strip()
-        await result_queue.put(result)
-    print("[MIC] Transcriber finished")
+        batch = await collect_batch(audio_queue)
+        # On a worker thread so the microphone handoff and the printing keep going while the GPU is busy
+        results = await loop.run_in_executor(None, _transcribe_batch, audio_model, batch)
+        for result in results:
+            await result_queue.put(result)
+    logger.debug("Transcriber finished")
 
 async def start_background(stop_future: asyncio.Future):
-    model = "large-v2"
-    audio_model = whisperx.load_model(model, "cuda")
+    # No language, _transcribe_batch detects it for every clip
+    audio_model = load_audio_model(language=None)
 
     energy = 100
     pause = 0.8
     dynamic_energy = False
 
-    audio_queue: asyncio.Queue[torch.Tensor] = asyncio.Queue()
-    result_queue: asyncio.Queue[str] = asyncio.Queue()
+    audio_queue: asyncio.Queue[np.ndarray] = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+    result_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
 
     asyncio.create_task(
         record_audio(
@@ -88,8 +106,11 @@ async def main():
             print(segments)
             # print(f"Transcribed text: {result}")
     except KeyboardInterrupt:
-        print("Stopping...")
+        logger.info("Stopping...")
         stop_future.set_result(True)
 
 if __name__ == "__main__":
+    # Status lines are debug level, only the transcriptions are printed by default
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
     asyncio.run(main())
@@ -0,0 +1,94 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("whisperx")
+
+import audio_backend
+
+
+def test_pcm_to_float32_accepts_bytes_backed_audio():
+    # Every microphone path wraps an immutable bytes block, which numba types as a read-only array
+    pcm = np.frombuffer(np.array([0, 16384, -32768, 32767], np.int16).tobytes(), np.int16)
+    assert not pcm.flags.writeable
+
+    out = audio_backend.pcm_to_float32(pcm)
+
+    np.testing.assert_allclose(out, pcm.astype(np.float32) / 32768.0)
+
+
+def test_pcm_to_float32_writes_into_a_slice():
+    pcm = np.frombuffer(np.arange(4, dtype=np.int16).tobytes(), np.int16)
+    window = np.zeros(8, np.float32)
+
+    audio_backend.pcm_to_float32(pcm, out=window[2:6])
+
+    np.testing.assert_allclose(window, np.array([0, 0, 0, 1, 2, 3, 0, 0], np.float32) / 32768.0)
+
+
+def test_extract_channel_accepts_bytes_backed_audio():
+    interleaved = np.frombuffer(np.arange(6, dtype=np.float32).tobytes(), np.float32)
+    assert not interleaved.flags.writeable
+
+    right = audio_backend.extract_channel(interleaved, 2, 1)
+
+    np.testing.assert_array_equal(right, np.array([1, 3, 5], np.float32))
+    assert right.flags.c_contiguous
+
+
+class _FakeModel:
+    # Reports one segment at the start of every non-silent run, the way the VAD would cut them,
+    # lead seconds early as the VAD does when it pads a segment
+    def __init__(self, lead=0.0):
+        self.calls = []
+        self.lead = lead
+
+    def transcribe(self, audio, batch_size, language=None):
+        self.calls.append(audio.copy())
+        segments = []
+        voiced = np.flatnonzero(audio)
+        starts = voiced[np.insert(np.diff(voiced) > 1, 0, True)]
+        for start in starts:
+            start_seconds = max(start / audio_backend.SAMPLE_RATE - self.lead, 0.0)
+            segments.append({"start": start_seconds, "end": start_seconds + 0.5, "text": f"at {start}"})
+        return {"segments": segments, "language": language or "en"}
+
+
+def test_transcribe_clips_scatters_segments_back_to_their_clips():
+    model = _FakeModel()
+    clips = [np.ones(100, np.float32), np.ones(200, np.float32)]
+
+    first, second = audio_backend.transcribe_clips(model, clips)
+
+    assert [segment["start"] for segment in first["segments"]] == [0.0]
+    assert [segment["start"] for segment in second["segments"]] == [0.0]
+    assert second["segments"][0]["end"] == pytest.approx(0.5)
+
+
+def test_transcribe_clips_keeps_a_segment_starting_just_before_its_clip():
+    model = _FakeModel(lead=0.2)
+    clips = [np.ones(100, np.float32), np.ones(200, np.float32)]
+
+    first, second = audio_backend.transcribe_clips(model, clips)
+
+    assert len(first["segments"]) == 1
+    assert len(second["segments"]) == 1
+    assert second["segments"][0]["start"] == pytest.approx(-0.2)
+
+
+def test_transcribe_clips_has_no_silence_after_the_last_clip():
+    model = _FakeModel()
+    gap = audio_backend.SAMPLE_RATE * audio_backend.BATCH_SEPARATOR_SECONDS
+
+    audio_backend.transcribe_clips(model, [np.ones(100, np.float32), np.ones(200, np.float32)])
+
+    assert len(model.calls[0]) == 100 + gap + 200
+
+
+def test_transcribe_clips_converts_a_lone_int16_clip():
+    model = _FakeModel()
+    pcm = np.frombuffer(np.full(10, 16384, np.int16).tobytes(), np.int16)
+
+    audio_backend.transcribe_clips(model, [pcm], convert=audio_backend.pcm_to_float32)
+
+    np.testing.assert_allclose(model.calls[0], np.full(10, 0.5, np.float32))
@@ -0,0 +1,51 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("torch")
+pytest.importorskip("whisperx")
+pytest.importorskip("sounddevice")
+
+from transcribe_hotkey import trim_segments_to_chunk
+
+
+def _continuous_speech(seconds: float = 5.5) -> list[dict]:
+    # One VAD region spanning the whole window, a word every half second
+    words = [{"word": f"w{i}", "start": i * 0.5, "end": i * 0.5 + 0.4} for i in range(int(seconds / 0.5))]
+    return [{"start": 0.0, "end": seconds, "text": " ".join(w["word"] for w in words), "words": words}]
+
+
+def test_long_segment_keeps_only_the_chunks_words():
+    # The segment's midpoint (2.75 s) is outside the chunk, but the words inside it must survive
+    trimmed = trim_segments_to_chunk(_continuous_speech(), 4.0, 5.0)
+
+    assert [segment["text"] for segment in trimmed] == ["w8 w9"]
+    assert trimmed[0]["start"] == 4.0
+    assert trimmed[0]["end"] == pytest.approx(4.9)
+
+
+def test_neighbouring_chunks_do_not_repeat_words():
+    segments = _continuous_speech()
+
+    first = trim_segments_to_chunk(segments, 3.0, 4.0)
+    second = trim_segments_to_chunk(segments, 4.0, 5.0)
+
+    assert first[0]["text"] == "w6 w7"
+    assert second[0]["text"] == "w8 w9"
+
+
+def test_untimed_words_follow_the_word_before_them():
+    words = [
+        {"word": "at", "start": 4.1, "end": 4.3},
+        {"word": "5"},
+        {"word": "pm", "start": 5.1, "end": 5.3},
+    ]
+    segments = [{"start": 3.0, "end": 5.5, "text": "at 5 pm", "words": words}]
+
+    trimmed = trim_segments_to_chunk(segments, 4.0, 5.0)
+
+    assert trimmed[0]["text"] == "at 5"
+    assert trimmed[0]["end"] == pytest.approx(4.2)
+
+
+def test_segments_outside_the_chunk_are_dropped():
+    assert trim_segments_to_chunk(_continuous_speech(2.0), 4.0, 5.0) == []
@@ -1,68 +1,139 @@
-import speech_recognition as sr
+from audio_backend import AUDIO_QUEUE_SIZE, MicFilter, RESULT_QUEUE_SIZE, SAMPLE_RATE, TRANSCRIBE_BATCH_SIZE, default_microphone, host_audio_buffer, load_audio_model, pcm_to_float32, put_dropping_oldest
 import asyncio
+import collections
 import torch
 import numpy as np
+import sounddevice as sd
 import whisperx
 from typing import *
 
+# Audio arrives in half second blocks. Each window sent to the transcriber is
+# left context + chunk + right context, and only the chunk's segments are kept,
+# so transcription overlaps with speech instead of waiting for a pause.
+BLOCK_SECONDS = 0.5
+LEFT_CONTEXT_BLOCKS = 8   # 4 s
+CHUNK_BLOCKS = 2          # 1 s
+RIGHT_CONTEXT_BLOCKS = 1  # 0.5 s
+
+# load_audio_model falls back to the CPU, the word aligner follows it
+ALIGN_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+def _emit_window(
+    audio_queue: asyncio.Queue[tuple[np.ndarray, float, float]],
+    history: collections.deque[np.ndarray],
+    chunk_blocks: int,
+    right_blocks: int
+):
+    # Each int16 block is scaled straight into its slot, no concatenated int16 copy in between.
+    # The window is page-locked, see host_audio_buffer.
+    window = host_audio_buffer(sum(len(block) for block in history))
+    position = 0
+    for block in history:
+        pcm_to_float32(block, out=window[position:position + len(block)])
+        position += len(block)
+    chunk_end = (len(history) - right_blocks) * BLOCK_SECONDS
+    chunk_start = chunk_end - chunk_blocks * BLOCK_SECONDS
+    put_dropping_oldest(audio_queue, (window, chunk_start, chunk_end), log=lambda message: print(f"[LISTEN] {message}"))
+
 async def record_audio(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[tuple[np.ndarray, float, float]],
     is_listening: asyncio.Event,
-    energy: int,
-    pause: float,
-    dynamic_energy: bool,
-    stop_future: asyncio.Future
+    stop_future: asyncio.Future,
+    mic_filter: MicFilter = default_microphone
 ):
-    r = sr.Recognizer()
-    r.energy_threshold = energy
-    r.pause_threshold = pause
-    r.dynamic_energy_threshold = dynamic_energy
-
     loop = asyncio.get_running_loop()
+    blocks: asyncio.Queue[np.ndarray] = asyncio.Queue()
+
+    def callback(indata, frame_count, time_info, status):
+        # Kept as int16, converted once when a window is cut
+        block = np.frombuffer(bytes(indata), np.int16)
+        loop.call_soon_threadsafe(blocks.put_nowait, block)
+
+    # Keeps filling while not listening, so the first chunk still gets left context
+    history = collections.deque(maxlen=LEFT_CONTEXT_BLOCKS + CHUNK_BLOCKS + RIGHT_CONTEXT_BLOCKS)
+    # Blocks heard while listening that haven't been inside a transcribed chunk yet
+    pending = 0
 
     print("[LISTEN] Starting listener")
-    with sr.Microphone(sample_rate=16000) as source:
+    with sd.RawInputStream(samplerate=SAMPLE_RATE, channels=1, dtype="int16", blocksize=int(SAMPLE_RATE * BLOCK_SECONDS), device=mic_filter(sd.query_devices()), callback=callback):
         print("[LISTEN] found microphone")
         while not stop_future.done():
-            audio = await loop.run_in_executor(None, r.listen, source)
+            history.append(await blocks.get())
             if is_listening.is_set():
-                np_audio = np.frombuffer(audio.get_raw_data(), np.int16).flatten().astype(np.float32) / 32768.0
-                await audio_queue.put(np_audio)
+                pending += 1
+                if pending >= CHUNK_BLOCKS + RIGHT_CONTEXT_BLOCKS:
+                    _emit_window(audio_queue, history, CHUNK_BLOCKS, RIGHT_CONTEXT_BLOCKS)
+                    pending -= CHUNK_BLOCKS
+            elif pending > 0:
+                # Key released, whatever is left becomes the final chunk with the block we just got as right context
+                _emit_window(audio_queue, history, pending, 1)
+                pending = 0
     print("[LISTEN] Listener finished")
 
+def trim_segments_to_chunk(segments: list[dict], chunk_start: float, chunk_end: float) -> list[dict]:
+    # Context only helps the model. whisperx segments are whole VAD regions that usually span the entire window,
+    # so keep the aligned words centred inside the chunk, neighbouring windows then never repeat each other.
+    trimmed = []
+    for segment in segments:
+        # The aligner can't place some tokens (digits, symbols), they take the time of the word before them
+        position = segment["start"]
+        kept = []
+        for word in segment.get("words", []):
+            if "start" in word and "end" in word:
+                position = (word["start"] + word["end"]) / 2
+            if chunk_start <= position < chunk_end:
+                kept.append((word, position))
+        if not kept:
+            continue
+        first, first_position = kept[0]
+        last, last_position = kept[-1]
+        trimmed.append({
+            "start": first.get("start", first_position),
+            "end": last.get("end", last_position),
+            "text": " ".join(word["word"] for word, _ in kept),
+            "words": [word for word, _ in kept],
+        })
+    return trimmed
+
+@torch.inference_mode()
+def _transcribe_window(audio_model: Any, align_model: Any, align_metadata: dict, window: np.ndarray, chunk_start: float, chunk_end: float) -> dict:
+    result = audio_model.transcribe(window, batch_size=TRANSCRIBE_BATCH_SIZE)
+    aligned = whisperx.align(result["segments"], align_model, align_metadata, window, ALIGN_DEVICE, return_char_alignments=False)
+    result["segments"] = trim_segments_to_chunk(aligned["segments"], chunk_start, chunk_end)
+    return result
+
 async def transcribe_audio(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[tuple[np.ndarray, float, float]],
     result_queue: asyncio.Queue[str],
     audio_model: Any,
+    align_model: Any,
+    align_metadata: dict,
     stop_future: asyncio.Future
 ):
     print("[TRANS] Starting transcriber")
+    loop = asyncio.get_running_loop()
     while not stop_future.done():
-        audio_data = await audio_queue.get()
-        result = audio_model.transcribe(audio_data, batch_size=16)
-        # predicted_text = str(result["text"]).strip()
+        audio_data, chunk_start, chunk_end = await audio_queue.get()
+        # On a worker thread so record_audio keeps cutting the next window while this one is on the GPU
+        result = await loop.run_in_executor(None, _transcribe_window, audio_model, align_model, align_metadata, audio_data, chunk_start, chunk_end)
         print(f"[TRANS] Got result {result}")
         await result_queue.put(result)
     print("[TRANS] Transcriber finished")
 
 async def start_audio_transcription_backend(is_listening: asyncio.Event, stop_future: asyncio.Future):
-    model = "large-v2"
-    audio_model = whisperx.load_model(model, device="cuda", language="en")
-
-    energy = 100
-    pause = 0.8
-    dynamic_energy = False
+    print("[TRANS] Loading whisperx model")
+    audio_model = load_audio_model()
+    # Word timestamps, so each window keeps only the words inside its chunk
+    align_model, align_metadata = whisperx.load_align_model(language_code="en", device=ALIGN_DEVICE)
 
-    audio_queue: asyncio.Queue[torch.Tensor] = asyncio.Queue()
-    result_queue: asyncio.Queue[str] = asyncio.Queue()
+    # Bounded so a stalled transcriber can't pile up audio, see put_dropping_oldest
+    audio_queue: asyncio.Queue[tuple[np.ndarray, float, float]] = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+    result_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
 
     asyncio.create_task(
         record_audio(
             audio_queue,
             is_listening,
-            energy,
-            pause,
-            dynamic_energy,
             stop_future,
         )
     )
@@ -72,6 +143,8 @@ async def start_audio_transcription_backend(is_listening: asyncio.Event, stop_fu
             audio_queue,
             result_queue,
             audio_model,
+            align_model,
+            align_metadata,
             stop_future,
         )
     )
@@ -91,23 +164,11 @@ async def start_keyboard_backend(is_listening: asyncio.Event, stop_future: async
             print("[HOTKEY] F23 released, stopping transcription.")
             is_listening.clear()
 
-    def listen_for_keys():
-        with keyboard.Listener(on_press=on_press, on_release=on_release) as listener:
-            listener.join()
-
-    import threading
-    listener_thread = threading.Thread(target=listen_for_keys)
-    listener_thread.start()
-
-    def stop_check():
-        while not stop_future.done():
-            threading.Event().wait(0.5)
-        listener_thread.join()
-
-    stop_check_thread = threading.Thread(target=stop_check)
-    stop_check_thread.start()
-
-        
+    # The listener runs on its own daemon thread, stop it as soon as we are told to stop
+    listener = keyboard.Listener(on_press=on_press, on_release=on_release)
+    listener.daemon = True
+    listener.start()
+    stop_future.add_done_callback(lambda _: listener.stop())
 
 async def main():
     stop_future = asyncio.Future()
@@ -124,7 +185,8 @@ async def main():
         while True:
             result = await result_queue.get()
             segments = result["segments"]
-            print("[MAIN] Transcribing...", segments)
+            if segments:
+                print("[MAIN] Transcribing...", segments)
     except KeyboardInterrupt:
         print("[MAIN] Stopping...")
         stop_future.set_result(True)
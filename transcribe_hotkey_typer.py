@@ -1,87 +1,230 @@
+from audio_backend import AUDIO_QUEUE_SIZE, MicFilter, RESULT_QUEUE_SIZE, SAMPLE_RATE, collect_batch, host_audio_buffer, load_audio_model, named_microphone, pcm_to_float32, put_dropping_oldest, query_input_devices, transcribe_clips_autocast
 from loguru import logger
 from pynput import keyboard
 from typing import *
 import aiohttp.web
 import asyncio
-import json
+import collections
+import functools
+import itertools
 import numpy as np
-import pyautogui
-import speech_recognition as sr
+import orjson
+import os
+import pyperclip
+import queue
+import sounddevice as sd
 import ssl
-import threading
+import sys
+import time
 import torch
 import uuid
-import whisperx
+import weakref
+
+keyboard_controller = keyboard.Controller()
+
+if sys.platform == "win32":
+    import ctypes
+    from ctypes import wintypes
+
+    INPUT_KEYBOARD = 1
+    KEYEVENTF_KEYUP = 0x0002
+    KEYEVENTF_UNICODE = 0x0004
+
+    class KEYBDINPUT(ctypes.Structure):
+        _fields_ = [
+            ("wVk", wintypes.WORD),
+            ("wScan", wintypes.WORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    class MOUSEINPUT(ctypes.Structure):
+        # Only here so the union below is as big as Windows expects
+        _fields_ = [
+            ("dx", wintypes.LONG),
+            ("dy", wintypes.LONG),
+            ("mouseData", wintypes.DWORD),
+            ("dwFlags", wintypes.DWORD),
+            ("time", wintypes.DWORD),
+            ("dwExtraInfo", ctypes.c_size_t),
+        ]
+
+    class INPUT(ctypes.Structure):
+        class _INPUT(ctypes.Union):
+            _fields_ = [("ki", KEYBDINPUT), ("mi", MOUSEINPUT)]
+        _anonymous_ = ("u",)
+        _fields_ = [("type", wintypes.DWORD), ("u", _INPUT)]
+
+    def _send_input(text: str) -> str:
+        # Every UTF-16 code unit as a unicode key down and up, all handed to the OS in a single SendInput call.
+        # Returns the part of the text that didn't go through.
+        units = memoryview(text.encode("utf-16-le")).cast("H")
+        inputs = (INPUT * (len(units) * 2))()
+        for i, unit in enumerate(units):
+            for j, flags in enumerate((KEYEVENTF_UNICODE, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP)):
+                event = inputs[i * 2 + j]
+                event.type = INPUT_KEYBOARD
+                event.ki.wScan = unit
+                event.ki.dwFlags = flags
+        sent = ctypes.windll.user32.SendInput(len(inputs), inputs, ctypes.sizeof(INPUT))
+        # The events that were inserted already reached the app, a key down on its own still types its character.
+        # A surrogate pair cut in half can't be recovered, its orphaned low half is dropped.
+        typed = (sent + 1) // 2
+        return units[typed:].tobytes().decode("utf-16-le", errors="ignore")
+
+# On a worker thread, so sleeping here doesn't hold up the event loop
+CLIPBOARD_RESTORE_DELAY = 0.2
+
+def _paste(text: str):
+    # One batch of input events (or one clipboard write and Ctrl+V) instead of a synthesized keystroke per character
+    if sys.platform == "win32":
+        remaining = _send_input(text)
+        if not remaining:
+            return
+        # SendInput is refused when another process holds the input desktop, e.g. UAC prompts.
+        # Only paste what it didn't deliver, otherwise the start of the transcript is entered twice.
+        logger.warning("SendInput was blocked after {} of {} characters, pasting the rest", len(text) - len(remaining), len(text))
+        text = remaining
+    try:
+        # Put back whatever the user had copied once we're done with the clipboard, only text survives the round trip
+        previous = pyperclip.paste()
+        pyperclip.copy(text)
+    except pyperclip.PyperclipException as e:
+        logger.warning("Clipboard unavailable ({}), typing instead", e)
+        keyboard_controller.type(text)
+        return
+    try:
+        with keyboard_controller.pressed(keyboard.Key.ctrl):
+            keyboard_controller.tap("v")
+        # The target app reads the clipboard when it handles Ctrl+V, give it a moment before swapping it back
+        time.sleep(CLIPBOARD_RESTORE_DELAY)
+    finally:
+        pyperclip.copy(previous)
+
+VAD_FRAME_SAMPLES = 512  # 32 ms, the frame size silero-vad expects at 16 kHz
+DESIRED_MIC = "Microphone (WOER)"
+
+# The listener sees every keystroke, including our own pasted transcripts, so the checks are single set lookups
+PUSH_TO_TALK_KEYS = frozenset({keyboard.Key.f23})
+TOGGLE_KEYS = frozenset({keyboard.Key.pause})
+ACTIVATION_KEYS = PUSH_TO_TALK_KEYS | TOGGLE_KEYS
+
+def _decode(raw: Union[bytes, bytearray]) -> np.ndarray:
+    pcm = np.frombuffer(raw, np.int16)
+    # frombuffer is already 1-D so nothing needs flattening
+    return pcm_to_float32(pcm, out=host_audio_buffer(pcm.shape[0]))
+
+def _listen(
+    frames: queue.SimpleQueue[bytes],
+    vad_model: Any,
+    device: str,
+    vad_threshold: float,
+    pause: float,
+    stop_future: asyncio.Future
+) -> Optional[bytearray]:
+    # Blocks until the VAD sees an utterance end, returns None if the stream goes quiet or we are stopping
+    silence_limit = int(pause * SAMPLE_RATE / VAD_FRAME_SAMPLES)
+    speech = bytearray()
+    silent_frames = 0
+    # Every frame is decoded and uploaded through the same scratch tensors instead of two fresh allocations per 32 ms
+    host_frame = torch.empty(VAD_FRAME_SAMPLES, dtype=torch.float32)
+    device_frame = host_frame.to(device)
+    while not stop_future.done():
+        try:
+            frame = frames.get(timeout=1)
+        except queue.Empty:
+            return None
+        pcm_to_float32(np.frombuffer(frame, np.int16), out=host_frame.numpy())
+        device_frame.copy_(host_frame)
+        with torch.inference_mode():
+            probability = vad_model(device_frame, SAMPLE_RATE).item()
+        if probability >= vad_threshold:
+            speech += frame
+            silent_frames = 0
+        elif speech:
+            speech += frame
+            silent_frames += 1
+            if silent_frames >= silence_limit:
+                vad_model.reset_states()
+                # Fresh per utterance, so it can be handed over without copying
+                return speech
+    return None
 
 async def start_microphone_worker(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[np.ndarray],
     keyboard_says_listen: asyncio.Event,
     api_says_listen: asyncio.Event,
-    energy: int,
+    vad_threshold: float,
     pause: float,
-    dynamic_energy: bool,
-    stop_future: asyncio.Future
+    stop_future: asyncio.Future,
+    mic_filter: MicFilter = named_microphone(DESIRED_MIC)
 ):
     try:
-        r = sr.Recognizer()
-        r.energy_threshold = energy
-        r.pause_threshold = pause
-        r.dynamic_energy_threshold = dynamic_energy
+        logger.info("Loading silero-vad model")
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        vad_model, _ = torch.hub.load("snakers4/silero-vad", "silero_vad")
+        vad_model = vad_model.to(device)
 
         loop = asyncio.get_running_loop()
 
         logger.info("Starting listener main loop")
-        logbackoff = 0
+        delay = 1
+        # Only enumerated again once the microphone goes away, enumerating restarts PortAudio
+        device_index: Optional[int] = None
         while not stop_future.done():
             try:
-                desired = [(i,v) for i,v in enumerate(sr.Microphone.list_microphone_names()) if v == "Microphone (WOER)"]
-                if len(desired) == 0:
-                    if logbackoff > 0:
-                        logbackoff -= 1
-                    else:
-                        logger.info("Desired microphone not found, waiting...")
-                        logbackoff = 10
-                    await asyncio.sleep(1)
+                if device_index is None:
+                    device_index = mic_filter(query_input_devices())
+                if device_index is None:
+                    logger.info("Desired microphone not found, checking again in {}s", delay)
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 30)
                     continue
-                with sr.Microphone(sample_rate=16000, device_index=desired[0][0]) as source:
+                delay = 1
+                frames: queue.SimpleQueue[bytes] = queue.SimpleQueue()
+                def callback(indata, frame_count, time_info, status):
+                    frames.put_nowait(bytes(indata))
+                with sd.RawInputStream(samplerate=SAMPLE_RATE, channels=1, dtype="int16", blocksize=VAD_FRAME_SAMPLES, device=device_index, callback=callback) as stream:
                     logger.info("Found microphone")
                     while not stop_future.done():
-                        audio = await loop.run_in_executor(None, r.listen, source)
+                        raw = await loop.run_in_executor(None, _listen, frames, vad_model, device, vad_threshold, pause, stop_future)
+                        if raw is None:
+                            if not stream.active:
+                                logger.warning("Microphone stream stopped, was it unplugged?")
+                                device_index = None
+                                break
+                            continue
                         if keyboard_says_listen.is_set() or api_says_listen.is_set():
                             logger.info("Got audio, was listening")
-                            np_audio = np.frombuffer(audio.get_raw_data(), np.int16).flatten().astype(np.float32) / 32768.0
-                            await audio_queue.put(np_audio)
+                            np_audio = await loop.run_in_executor(None, _decode, raw)
+                            put_dropping_oldest(audio_queue, np_audio)
                         else:
                             logger.info("Got audio, wasn't listening")
-            except OSError:
+            except (OSError, sd.PortAudioError):
                 logger.exception(f"Microphone error, was it unplugged?")
+                device_index = None
         logger.info("Listener main loop finished")
     except Exception as e:
         logger.exception("Listener main loop crashed: {}", e)
 
 async def start_transcription_worker(
-    audio_queue: asyncio.Queue[torch.Tensor],
+    audio_queue: asyncio.Queue[np.ndarray],
     result_queue: asyncio.Queue[str],
     stop_future: asyncio.Future
 ):
     try:
-        logger.info("Loading whisperx model")
-        if torch.cuda.is_available():
-            # https://huggingface.co/openai/whisper-large-v2
-            model = "large-v2"
-            audio_model = whisperx.load_model(model, device="cuda", language="en")
-        else:
-            # https://huggingface.co/openai/whisper-small.en
-            model = "small.en"
-            audio_model = whisperx.load_model(model, device="cpu", language="en", compute_type="float32")
+        audio_model = load_audio_model()
 
         logger.info("Starting transcriber main loop")
+        loop = asyncio.get_running_loop()
         while not stop_future.done():
-            audio_data = await audio_queue.get()
-            result = audio_model.transcribe(audio_data, batch_size=16)
-            # predicted_text = str(result["text"]).strip()
-            logger.info(f"Got result {result}")
-            await result_queue.put(result)
+            batch = await collect_batch(audio_queue)
+            # On a worker thread so the microphone and the typing keep going while the GPU is busy
+            results = await loop.run_in_executor(None, transcribe_clips_autocast, audio_model, batch)
+            for result in results:
+                logger.info(f"Got result {result}")
+                await result_queue.put(result)
         logger.info("Transcriber main loop finished")
     except Exception as e:
         logger.exception("Transcriber main loop crashed: {}", e)
@@ -92,60 +235,89 @@ async def start_keyboard_worker(
     stop_future: asyncio.Future
 ):
     try:
-        def is_push_to_talk_key(key):
-            return key == keyboard.Key.f23
-
-        def is_toggle_key(key):
-            return key == keyboard.Key.pause
-
         def on_press(key):
-            if is_push_to_talk_key(key):
+            if key not in ACTIVATION_KEYS:
+                return
+            if key in PUSH_TO_TALK_KEYS:
                 if not keyboard_says_listen.is_set():
                     logger.info("Push-to-talk key pressed, starting transcription.")
                     keyboard_says_listen.set()
-            elif is_toggle_key(key):
-                if keyboard_says_listen.is_set():
-                    logger.info("Toggle key pressed, stopping transcription.")
-                    keyboard_says_listen.clear()
-                else:
-                    logger.info("Toggle key pressed, starting transcription.")
-                    keyboard_says_listen.set()
+            elif keyboard_says_listen.is_set():
+                logger.info("Toggle key pressed, stopping transcription.")
+                keyboard_says_listen.clear()
+            else:
+                logger.info("Toggle key pressed, starting transcription.")
+                keyboard_says_listen.set()
             api_says_listen.clear()  # Clear API listening state on manual activation
 
         def on_release(key):
-            if is_push_to_talk_key(key) and keyboard_says_listen.is_set():
+            if key in PUSH_TO_TALK_KEYS and keyboard_says_listen.is_set():
                 logger.info("Push-to-talk key released, stopping transcription.")
                 keyboard_says_listen.clear()
 
-        def listen_for_keys():
-            with keyboard.Listener(on_press=on_press, on_release=on_release) as listener:
-                listener.join()
-
-        listener_thread = threading.Thread(target=listen_for_keys)
-        listener_thread.daemon = True
-        listener_thread.start()
-
-        def stop_check():
-            while not stop_future.done():
-                threading.Event().wait(0.5)
-            listener_thread.join()
-
-        stop_check_thread = threading.Thread(target=stop_check)
-        stop_check_thread.daemon = True
-        stop_check_thread.start()
+        # The listener runs on its own daemon thread, stop it as soon as we are told to stop
+        listener = keyboard.Listener(on_press=on_press, on_release=on_release)
+        listener.daemon = True
+        listener.start()
+        stop_future.add_done_callback(lambda _: listener.stop())
     except Exception as e:
         logger.exception("Keyboard worker crashed: {}", e)
     
 class WebsocketEntry:
     session_id: str
-    outbound_queue: asyncio.Queue[str]
+    cursor: int
     latest_keepalive: float
-    def __init__(self, session_id: str, outbound_queue: asyncio.Queue[str]):
+    def __init__(self, session_id: str, cursor: int):
         self.session_id = session_id
-        self.outbound_queue = outbound_queue
+        self.cursor = cursor
         self.latest_keepalive = asyncio.get_event_loop().time()
 
-active_websockets: dict[str,WebsocketEntry] = {}
+class Broadcast:
+    # One shared log of results, each websocket tracks its own cursor into it
+    seq: int
+    log: collections.deque[tuple[int, Any]]
+    cond: asyncio.Condition
+    def __init__(self, capacity: int = 256):
+        self.seq = 0
+        self.log = collections.deque(maxlen=capacity)
+        self.cond = asyncio.Condition()
+
+    async def publish(self, item: Any):
+        async with self.cond:
+            self.seq += 1
+            self.log.append((self.seq, item))
+            self.cond.notify_all()
+
+    async def wake(self):
+        # Lets waiting websockets notice they were closed
+        async with self.cond:
+            self.cond.notify_all()
+
+    def since(self, cursor: int) -> list[Any]:
+        # seqs are contiguous, so what a cursor hasn't seen is just the tail of the log
+        missed = min(self.seq - cursor, len(self.log))
+        tail = [item for _, item in itertools.islice(reversed(self.log), missed)]
+        tail.reverse()
+        return tail
+
+results_broadcast = Broadcast()
+
+# Entries are kept alive by their connect_websocket handler, so they disappear once it returns
+active_websockets: weakref.WeakValueDictionary[str,WebsocketEntry] = weakref.WeakValueDictionary()
+
+@functools.lru_cache(maxsize=None)
+def _server_ssl_context() -> ssl.SSLContext:
+    # Built once per process, restarts of the webserver reuse it and its session ticket keys
+    ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    ssl_context.load_cert_chain("localhost.pem", "localhost-key.pem")
+    # aiohttp only speaks HTTP/1.1, so don't offer h2
+    ssl_context.set_alpn_protocols(["http/1.1"])
+    # Session tickets let reconnecting clients resume instead of doing a full handshake
+    ssl_context.options &= ~ssl.OP_NO_TICKET
+    return ssl_context
+
+# How long /start_listening waits for a /results websocket before it stops listening again
+START_LISTENING_GRACE_SECONDS = 1.0
 
 async def start_webserver_worker(
     api_says_listen: asyncio.Event,
@@ -154,14 +326,24 @@ async def start_webserver_worker(
     api_key: str
 ):
     try:
+        loop = asyncio.get_running_loop()
+        # Pending check that someone actually connected to /results after /start_listening
+        listener_check: Optional[asyncio.TimerHandle] = None
+
         # POST /start_listening
         async def start_listening(request):
+            nonlocal listener_check
             # Check API key
             if request.headers.get('Authorization') != api_key:
                 return aiohttp.web.Response(status=401, text='Unauthorized')
             
             logger.info("Starting listening because of API request")
             api_says_listen.set()  # Indicate that listening was started via API
+            # Clients may connect to /results just after this, so give them the same second the old poll did.
+            # If nobody does, forget_websocket never runs and nothing else would stop listening.
+            if listener_check is not None:
+                listener_check.cancel()
+            listener_check = loop.call_later(START_LISTENING_GRACE_SECONDS, stop_listening_without_websockets)
             return aiohttp.web.Response(text="Listening started")
 
         # POST /stop_listening
@@ -187,15 +369,23 @@ async def start_webserver_worker(
         async def index(request):
             return aiohttp.web.Response(text="Ahoy!")
         
+        def stop_listening_without_websockets():
+            if api_says_listen.is_set() and len(active_websockets) == 0:
+                logger.info("No active websockets, unsetting api_listening")
+                api_says_listen.clear()
+
+        def forget_websocket(session_id: str):
+            # Checked whenever a websocket goes away rather than polled, once the last one is gone nobody is reading results
+            active_websockets.pop(session_id, None)
+            stop_listening_without_websockets()
+
         async def connect_websocket(request):
             ws = aiohttp.web.WebSocketResponse()
             await ws.prepare(request)
 
             # Generate a unique ID for each websocket session
-            ws_queue = asyncio.Queue()
-
             global active_websockets
-            entry = WebsocketEntry(session_id=str(uuid.uuid4()), outbound_queue=ws_queue)
+            entry = WebsocketEntry(session_id=str(uuid.uuid4()), cursor=results_broadcast.seq)
             active_websockets[entry.session_id] = entry
 
             logger.info("Starting keepalive receiver")
@@ -203,14 +393,16 @@ async def start_webserver_worker(
 
             try:
                 while not ws.closed and not stop_future.done():
-                    to_send = await ws_queue.get()
-                    await ws.send_str(json.dumps(to_send))
+                    async with results_broadcast.cond:
+                        await results_broadcast.cond.wait_for(lambda: entry.cursor < results_broadcast.seq or ws.closed)
+                        to_send = results_broadcast.since(entry.cursor)
+                        entry.cursor = results_broadcast.seq
+                    for payload in to_send:
+                        await ws.send_bytes(payload)
             finally:
-                # for some reason we never get here
-                # the keepalive receiver does trigger closed tho
-                # and if that fails, the keepalive will clean it up
+                # the keepalive receiver wakes us up once the socket closes
                 logger.info("Websocket closed")
-                del active_websockets[entry.session_id]
+                forget_websocket(entry.session_id)
 
             return ws
         
@@ -228,30 +420,23 @@ async def start_webserver_worker(
                     logger.error(f"Websocket error: {ws.exception()}")
                     break
             logger.info("Websocket closed")
-            del active_websockets[entry.session_id]
+            forget_websocket(entry.session_id)
+            await results_broadcast.wake()
         
         async def start_keepalive_prune_worker(stop_future: asyncio.Future):
             global active_websockets
             timeout = 10
             while not stop_future.done():
                 await asyncio.sleep(10)
-                for session_id, entry in active_websockets.items():
-                    if asyncio.get_event_loop().time() - entry.latest_keepalive > timeout:
-                        logger.info(f"No keepalive received from session {session_id} in the past {timeout} seconds, closing")
-                        del active_websockets[session_id]
-
-        async def start_auto_unlisten_worker(stop_future: asyncio.Future):
-            global active_websockets
-            while not stop_future.done():
-                await asyncio.sleep(1)
-                if api_says_listen.is_set() and len(active_websockets) == 0:
-                    logger.info("No active websockets, unsetting api_listening")
-                    api_says_listen.clear()
+                # Snapshot first, deleting while iterating the dict raises and kills this worker
+                now = asyncio.get_event_loop().time()
+                stale = [session_id for session_id, entry in list(active_websockets.items()) if now - entry.latest_keepalive > timeout]
+                for session_id in stale:
+                    logger.info(f"No keepalive received from session {session_id} in the past {timeout} seconds, closing")
+                    forget_websocket(session_id)
 
         logger.info("Starting keepalive prune worker")
         asyncio.create_task(start_keepalive_prune_worker(stop_future))
-        logger.info("Starting auto unlisten worker")
-        asyncio.create_task(start_auto_unlisten_worker(stop_future))
 
         app = aiohttp.web.Application()
         app.add_routes([
@@ -264,17 +449,12 @@ async def start_webserver_worker(
         runner = aiohttp.web.AppRunner(app)
         await runner.setup()
 
-        
-        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        ssl_context.load_cert_chain("localhost.pem", "localhost-key.pem")
-
         logger.info(f"Starting web server on port {port}")
-        site = aiohttp.web.TCPSite(runner, "localhost", port, ssl_context=ssl_context)
+        site = aiohttp.web.TCPSite(runner, "localhost", port, ssl_context=_server_ssl_context())
         await site.start()
 
         # Keep the server running until stop_future is set
-        while not stop_future.done():
-            await asyncio.sleep(1)
+        await stop_future
 
         await runner.cleanup()
     except Exception as e:
@@ -283,13 +463,12 @@ async def start_webserver_worker(
 
 async def start_router_worker(api_says_listen: asyncio.Event, result_queue: asyncio.Queue[str], typewriter_queue: asyncio.Queue[str], stop_future: asyncio.Future):
     try:
-        global active_websockets
         while not stop_future.done():
             result = await result_queue.get()
             if api_says_listen.is_set():
-                # Forward result to each websocket queue
-                for entry in active_websockets.values():
-                    await entry.outbound_queue.put(result)
+                # Serialize and publish once, each websocket picks it up from the shared log.
+                # Alignment leaves numpy floats in the word timings, orjson writes those natively.
+                await results_broadcast.publish(orjson.dumps(result, option=orjson.OPT_SERIALIZE_NUMPY))
             else:
                 # Forward result to the typewriter queue
                 await typewriter_queue.put(result)
@@ -315,9 +494,9 @@ async def main():
         keyboard_says_listen = asyncio.Event()
         api_says_listen = asyncio.Event()
 
-        audio_queue: asyncio.Queue[torch.Tensor] = asyncio.Queue()
-        result_queue: asyncio.Queue[str] = asyncio.Queue()
-        typewriter_queue: asyncio.Queue[str] = asyncio.Queue()
+        audio_queue: asyncio.Queue[np.ndarray] = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+        result_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
+        typewriter_queue: asyncio.Queue[str] = asyncio.Queue(maxsize=RESULT_QUEUE_SIZE)
 
         logger.info("Starting microphone worker")
         asyncio.create_task(
@@ -325,9 +504,8 @@ async def main():
                 audio_queue,
                 keyboard_says_listen,
                 api_says_listen,
-                energy=300,
-                pause=0.8,
-                dynamic_energy=False,
+                vad_threshold=0.5,
+                pause=0.3,
                 stop_future=stop_future,
             )
         )
@@ -349,14 +527,22 @@ async def main():
             logger.warning("No API key supplied, not starting web server")
 
         logger.info("Beginning main loop - hold activation key to perform transcription")
+        loop = asyncio.get_running_loop()
         try:
             while True:
-                result = await typewriter_queue.get()
-                segments = result["segments"]
+                results = [await typewriter_queue.get()]
+                # Anything that finished while the last paste was going out is typed along with this one
+                while not typewriter_queue.empty():
+                    results.append(typewriter_queue.get_nowait())
+                segments = [segment for result in results for segment in result["segments"]]
                 logger.info("Transcribing...", segments)
-                to_type = " ".join([segment["text"] for segment in segments]).strip()
+                to_type = " ".join(segment["text"] for segment in segments).strip()
+                if not to_type:
+                    # Silence or noise, nothing to paste and no reason to touch the clipboard
+                    continue
                 logger.info("Typing...", to_type)
-                pyautogui.typewrite(to_type)
+                # Paste from a worker thread so the other workers keep running while the keystrokes go out
+                await loop.run_in_executor(None, _paste, to_type)
         except KeyboardInterrupt:
             logger.info("Stopping...")
             stop_future.set_result(True)
@@ -364,6 +550,12 @@ async def main():
         logger.exception("Main loop crashed: {}", e)
 
 if __name__ == "__main__":
+    try:
+        # uvloop's event loop is faster at the websocket and executor traffic, it isn't available on Windows
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
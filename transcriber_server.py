@@ -1,24 +1,29 @@
 # server.py
 
-import ssl
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import JSONResponse
-import whisperx
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 import uvicorn
-import io
 import traceback
 import numpy as np
-import soundfile as sf  # Import soundfile for reading audio data
+import torch
+import torchaudio
 from loguru import logger
-import librosa  # For resampling
+from audio_backend import SAMPLE_RATE, BodyTooLarge, TranscribeBatcher, extract_channel, host_audio_buffer, load_audio_model, parse_audio_content_type, read_body, transcribe_clips
 
 app = FastAPI()
+# Transcripts of long audio run to tens of KB of JSON, small bodies aren't worth compressing
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 # Load the WhisperX model
 try:
     logger.info("Loading WhisperX model...")
-    model = whisperx.load_model("large-v2", device="cuda", language="en")
+    # Greedy decoding on int8 weights with log-mel and VAD on the GPU, warmed up before the first request arrives.
+    # The log-mel upload buffer is shared, one transcribe worker means it is never used by two batches at once.
+    model = load_audio_model()
     logger.info("WhisperX model loaded successfully.")
 except Exception as e:
     logger.error(f"Failed to load WhisperX model: {e}")
@@ -26,8 +31,11 @@ except Exception as e:
 
 
 
+# load_audio_model falls back to the CPU without a GPU, resampling has to as well
+RESAMPLE_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
 def process_audio(audio_data, sample_rate, channel_count):
-    # Convert raw byte data into numpy array (assuming float32)
+    # Wrap the raw bytes as float32 without copying
     np_audio = np.frombuffer(audio_data, dtype=np.float32)
     logger.debug(f"Processed audio to numpy array with shape {np_audio.shape}, dtype {np_audio.dtype}")
 
@@ -35,35 +43,65 @@ def process_audio(audio_data, sample_rate, channel_count):
     if len(np_audio) % channel_count != 0:
         raise ValueError(f"Audio length {len(np_audio)} is not divisible by channel count {channel_count}")
 
-    # Reshape into (samples_per_channel, channel_count)
-    np_audio = np_audio.reshape((-1, channel_count))
+    if channel_count == 1:
+        mono = np_audio
+    else:
+        # Read the right channel (index 1) straight out of the interleaved buffer, whisperx wants contiguous audio
+        mono = extract_channel(np_audio, channel_count, 1)
+
+    if sample_rate == SAMPLE_RATE:
+        # Copied once into pinned memory so whisperx's per chunk uploads don't queue on the shared staging buffer
+        out = host_audio_buffer(len(mono))
+        out[:] = mono
+        return out
+
+    # The polyphase filter is a convolution, on the GPU it takes a fraction of what it does on the CPU.
+    # whisperx's VAD wants numpy, so the result comes back to the host, into pinned memory for the same reason as above.
+    resampled = torchaudio.functional.resample(torch.from_numpy(mono).to(RESAMPLE_DEVICE), sample_rate, SAMPLE_RATE)
+    out = host_audio_buffer(resampled.shape[0])
+    torch.from_numpy(out).copy_(resampled)
+    return out
+
 
-    # Extract the desired channel (e.g., right channel for 2-channel audio)
-    right_channel = np_audio[:, 1]  # Assuming the right channel is at index 1
+# Requests that arrive within MAX_WAIT_MS of each other are transcribed in one call
+MAX_BATCH = 8
+MAX_WAIT_MS = 20
 
-    return right_channel
+# Number of batches allowed on the GPU at once
+TRANSCRIBE_WORKERS = 1
 
+def transcribe_batch(clips: list[np.ndarray]) -> list[dict]:
+    return transcribe_clips(model, clips)
+
+batcher = TranscribeBatcher(transcribe_batch, ThreadPoolExecutor(max_workers=TRANSCRIBE_WORKERS), TRANSCRIBE_WORKERS, MAX_BATCH, MAX_WAIT_MS / 1000)
+
+@app.on_event("startup")
+async def start_batcher():
+    app.state.batcher = asyncio.create_task(batcher.run())
 
 @app.post("/transcribe")
 async def transcribe(request: Request):
-    # Ensure the Content-Type is audio/wav
-    content_type = request.headers.get("Content-Type")
-    if content_type != "audio/f32le":
+    content_type = request.headers.get("Content-Type", "")
+    try:
+        sample_rate, channel_count = parse_audio_content_type(content_type, "audio/f32le")
+    except ValueError as e:
         logger.warning(f"Invalid Content-Type received: {content_type}")
-        raise HTTPException(status_code=400, detail="Invalid Content-Type. Expected 'audio/f32le'.")
+        raise HTTPException(status_code=400, detail=str(e))
 
     # Read the raw bytes from the request body
     try:
-        audio_bytes = await request.body()
+        audio_bytes = await read_body(request)
         logger.debug(f"Received {len(audio_bytes)} bytes of body data.")
+    except BodyTooLarge as e:
+        logger.warning(f"Refused request body: {e}")
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to read request body: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to read request body: {e}")
 
-    # Convert the raw bytes into a NumPy array of float32
+    # Convert the raw bytes into 16 kHz mono float32
     try:
-        np_audio = np.frombuffer(audio_bytes, dtype=np.float32)
-        logger.debug(f"Processed audio to numpy array with shape {np_audio.shape}, dtype {np_audio.dtype}")
+        np_audio = await asyncio.get_running_loop().run_in_executor(None, process_audio, audio_bytes, sample_rate, channel_count)
     except Exception as e:
         logger.error(f"Error processing audio data: {e}")
         traceback.print_exc()
@@ -72,7 +110,7 @@ async def transcribe(request: Request):
     # Transcribe the audio using WhisperX
     try:
         logger.info("Starting transcription...")
-        result = model.transcribe(np_audio, batch_size=16)
+        result = await batcher.submit(np_audio)
         logger.info("Transcription completed successfully.")
     except Exception as e:
         logger.error(f"Transcription failed: {e}")
@@ -80,7 +118,8 @@ async def transcribe(request: Request):
         raise HTTPException(status_code=500, detail=f"Transcription failed: {e}")
 
     logger.debug(f"Transcription result: {result}")
-    return JSONResponse(content=result)
+    # Serialized with orjson straight to bytes rather than json.dumps to str and then encoded
+    return ORJSONResponse(content=result)
 
 
 